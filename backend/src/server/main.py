@@ -1,27 +1,34 @@
 import argparse
+import asyncio
 import base64
 import enum
 import hashlib
+import json
 import logging
 import logging.config
 import os
+import shutil
 import uuid
+import zlib
 from datetime import datetime
 from io import BytesIO
 from typing import List, Optional, Dict, Tuple
 
 import chromadb
 from chromadb.utils import embedding_functions
-from fastapi import FastAPI, UploadFile, HTTPException, BackgroundTasks, Depends, Body
+from fastapi import FastAPI, UploadFile, HTTPException, BackgroundTasks, Depends, Body, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from fpdf import FPDF
 from openai import AsyncOpenAI
+import orjson
 from pdf2image import convert_from_bytes
 from PIL import Image
 from pydantic import BaseModel
 from rank_bm25 import BM25Okapi
-from sqlalchemy import Column, String, Text, DateTime, create_engine
+from sqlalchemy import Column, String, Text, DateTime, create_engine, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 import unicodedata
@@ -64,6 +71,14 @@ if not os.path.exists(FONT_PATH):
 MAX_CONTEXT_TOKENS = int(os.getenv("MAX_CONTEXT_TOKENS", "12000"))
 MAX_HISTORY_TOKENS = int(os.getenv("MAX_HISTORY_TOKENS", "3000"))
 
+# ========================= CHUNKED UPLOADS =========================
+
+UPLOAD_CHUNKS_DIR = os.getenv("UPLOAD_CHUNKS_DIR", "./upload_chunks")
+MAX_UPLOAD_CHUNK_SIZE = 16 * 1024 * 1024
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(500 * 1024 * 1024)))
+# Uploads with no chunk activity for this long are swept on the next init
+STALE_UPLOAD_SECONDS = int(os.getenv("STALE_UPLOAD_SECONDS", str(6 * 3600)))
+
 logger.info(f"Context limits: MAX_CONTEXT_TOKENS={MAX_CONTEXT_TOKENS}, MAX_HISTORY_TOKENS={MAX_HISTORY_TOKENS}")
 
 # ========================= FASTAPI APP =========================
@@ -72,8 +87,75 @@ app = FastAPI(
     title="dwani.ai API",
     description="Privacy-focused multimodal document extraction, regeneration, and multi-document aware hybrid RAG API",
     version="1.3.0",
+    default_response_class=ORJSONResponse,
 )
 
+# Upper bound for a gzip-encoded request body once inflated (chat payloads are far smaller)
+MAX_DECOMPRESSED_BODY = 8 * 1024 * 1024
+
+
+class GzipRequestMiddleware:
+    """Transparently decompress request bodies sent with `Content-Encoding: gzip`."""
+
+    def __init__(self, app):
+        self.app = app
+
+    @staticmethod
+    async def reject(status_code, detail, scope, receive, send):
+        response = JSONResponse(status_code=status_code, content={"detail": detail})
+        await response(scope, receive, send)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        if headers.get(b"content-encoding", b"").lower() != b"gzip":
+            return await self.app(scope, receive, send)
+
+        parts = []
+        received = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            parts.append(message.get("body", b""))
+            received += len(parts[-1])
+            more_body = message.get("more_body", False)
+            if received > MAX_DECOMPRESSED_BODY:
+                return await self.reject(413, "Request body too large", scope, receive, send)
+
+        # Bounded inflate, so a small gzip bomb can't expand to gigabytes in memory
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = decompressor.decompress(b"".join(parts), MAX_DECOMPRESSED_BODY + 1)
+        except zlib.error:
+            return await self.reject(400, "Invalid gzip request body", scope, receive, send)
+        if len(body) > MAX_DECOMPRESSED_BODY or decompressor.unconsumed_tail:
+            return await self.reject(413, "Request body too large", scope, receive, send)
+        if not decompressor.eof:
+            return await self.reject(400, "Invalid gzip request body", scope, receive, send)
+
+        scope = dict(scope)
+        scope["headers"] = [
+            (k, v) for k, v in scope["headers"] if k not in (b"content-encoding", b"content-length")
+        ] + [(b"content-length", str(len(body)).encode())]
+
+        body_sent = False
+
+        async def receive_decompressed():
+            nonlocal body_sent
+            if body_sent:
+                # Later receives (e.g. disconnect listeners) go to the real channel
+                return await receive()
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        await self.app(scope, receive_decompressed, send)
+
+
+app.add_middleware(GzipRequestMiddleware)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["https://app.dwani.ai", "http://localhost:5173", "http://127.0.0.1:5173", "https://*.dwani.ai"],
@@ -102,6 +184,7 @@ class FileRecord(Base):
     id = Column(String, primary_key=True)
     filename = Column(String, index=True)
     content_type = Column(String)
+    content_hash = Column(String, index=True, nullable=True)
     status = Column(String, default=FileStatus.PENDING)
     extracted_text = Column(Text, nullable=True)
     error_message = Column(Text, nullable=True)
@@ -111,6 +194,12 @@ class FileRecord(Base):
 
 Base.metadata.create_all(bind=engine)
 
+# create_all doesn't add columns to an existing table, so backfill content_hash on older DBs
+if "content_hash" not in {c["name"] for c in inspect(engine).get_columns("files")}:
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE files ADD COLUMN content_hash VARCHAR"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_files_content_hash ON files (content_hash)"))
+
 
 def get_db():
     db = SessionLocal()
@@ -169,6 +258,26 @@ class MergePdfRequest(BaseModel):
     file_ids: List[str]
 
 
+class FileStatusRequest(BaseModel):
+    ids: List[str]
+
+
+class FileStatusWaitRequest(BaseModel):
+    ids: List[str]
+    timeout: float = 30
+
+
+class ChunkedUploadInitRequest(BaseModel):
+    filename: str
+    size: int
+    chunk_size: int
+
+
+class ChunkedUploadInitResponse(BaseModel):
+    upload_id: str
+    chunk_count: int
+
+
 # ========================= UTILS =========================
 
 def clean_text(text: str) -> str:
@@ -311,6 +420,61 @@ def generate_pdf_from_text(text: str) -> BytesIO:
     return output
 
 
+# ========================= STATUS NOTIFICATIONS =========================
+
+MAX_STATUS_WAIT = 60
+TERMINAL_STATUSES = {FileStatus.COMPLETED.value, FileStatus.FAILED.value}
+
+# One event per file with waiters; set (and dropped) whenever that file's status changes,
+# and dropped by the last waiter to leave if it never does
+status_events: Dict[str, asyncio.Event] = {}
+status_waiter_counts: Dict[str, int] = {}
+
+
+def notify_status_change(file_id: str):
+    event = status_events.pop(file_id, None)
+    if event:
+        event.set()
+
+
+def file_statuses(db: Session, file_ids: List[str]) -> Dict[str, str]:
+    rows = db.query(FileRecord.id, FileRecord.status).filter(FileRecord.id.in_(file_ids)).all()
+    return {file_id: status for file_id, status in rows}
+
+
+async def wait_for_status_change(db: Session, file_ids: List[str], timeout: float) -> Dict[str, str]:
+    """Return statuses immediately if any file is finished or unknown, else once any of them changes."""
+    statuses = file_statuses(db, file_ids)
+    if len(statuses) < len(file_ids) or any(s in TERMINAL_STATUSES for s in statuses.values()):
+        return statuses
+
+    # End the read transaction so the pooled connection isn't held for the whole wait
+    db.rollback()
+
+    events = {}
+    for file_id in dict.fromkeys(file_ids):
+        events[file_id] = status_events.setdefault(file_id, asyncio.Event())
+        status_waiter_counts[file_id] = status_waiter_counts.get(file_id, 0) + 1
+
+    waiters = [asyncio.create_task(event.wait()) for event in events.values()]
+    try:
+        await asyncio.wait(waiters, timeout=min(timeout, MAX_STATUS_WAIT), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for waiter in waiters:
+            waiter.cancel()
+        # Drop events nobody is waiting on any more, so files that never change don't leak
+        for file_id, event in events.items():
+            remaining = status_waiter_counts.get(file_id, 0) - 1
+            if remaining > 0:
+                status_waiter_counts[file_id] = remaining
+                continue
+            status_waiter_counts.pop(file_id, None)
+            if status_events.get(file_id) is event:
+                del status_events[file_id]
+
+    return file_statuses(db, file_ids)
+
+
 # ========================= BACKGROUND TASK =========================
 
 async def background_extraction_task(file_id: str, pdf_bytes: bytes, filename: str, db: Session):
@@ -320,6 +484,7 @@ async def background_extraction_task(file_id: str, pdf_bytes: bytes, filename: s
 
     file_record.status = FileStatus.PROCESSING
     db.commit()
+    notify_status_change(file_id)
 
     try:
         images = await pdf_to_images(pdf_bytes)
@@ -340,6 +505,7 @@ async def background_extraction_task(file_id: str, pdf_bytes: bytes, filename: s
     finally:
         file_record.updated_at = datetime.utcnow()
         db.commit()
+        notify_status_change(file_id)
 
 
 # ========================= HYBRID SEARCH HELPERS =========================
@@ -423,7 +589,12 @@ async def upload_file(
     content = await file.read()
     file_id = str(uuid.uuid4())
 
-    record = FileRecord(id=file_id, filename=file.filename, content_type=file.content_type)
+    record = FileRecord(
+        id=file_id,
+        filename=file.filename,
+        content_type=file.content_type,
+        content_hash=hashlib.sha256(content).hexdigest(),
+    )
     db.add(record)
     db.commit()
 
@@ -436,6 +607,168 @@ async def upload_file(
     )
 
 
+def chunked_upload_dir(upload_id: str) -> str:
+    try:
+        uuid.UUID(upload_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    path = os.path.join(UPLOAD_CHUNKS_DIR, upload_id)
+    if not os.path.isdir(path):
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return path
+
+
+def read_upload_meta(path: str) -> Dict:
+    with open(os.path.join(path, "meta.json")) as f:
+        return json.load(f)
+
+
+def remove_if_exists(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def chunk_count(meta: Dict) -> int:
+    return -(-meta["size"] // meta["chunk_size"])
+
+
+def sweep_stale_uploads():
+    """Remove upload dirs that were never completed; each chunk write refreshes the dir mtime."""
+    if not os.path.isdir(UPLOAD_CHUNKS_DIR):
+        return
+    cutoff = datetime.now().timestamp() - STALE_UPLOAD_SECONDS
+    for entry in os.scandir(UPLOAD_CHUNKS_DIR):
+        try:
+            if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                logger.info(f"Removed stale chunked upload {entry.name}")
+        except OSError:
+            continue
+
+
+@app.post("/files/upload/init", response_model=ChunkedUploadInitResponse, tags=["Files"])
+def init_chunked_upload(request: ChunkedUploadInitRequest):
+    if not request.filename.lower().endswith(".pdf"):
+        raise HTTPException(status_code=400, detail="Only PDF files supported")
+    if request.size <= 0 or not 0 < request.chunk_size <= MAX_UPLOAD_CHUNK_SIZE:
+        raise HTTPException(status_code=400, detail="Invalid size or chunk_size")
+    if request.size > MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=413, detail=f"File exceeds {MAX_UPLOAD_SIZE} bytes")
+
+    sweep_stale_uploads()
+
+    upload_id = str(uuid.uuid4())
+    path = os.path.join(UPLOAD_CHUNKS_DIR, upload_id)
+    os.makedirs(path)
+    meta = request.model_dump()
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    return ChunkedUploadInitResponse(upload_id=upload_id, chunk_count=chunk_count(meta))
+
+
+@app.put("/files/upload/{upload_id}/{index}", tags=["Files"])
+async def upload_chunk(upload_id: str, index: int, request: Request):
+    # Disk I/O runs in the threadpool so large chunks don't stall SSE chat and status long-polls
+    path = await run_in_threadpool(chunked_upload_dir, upload_id)
+    meta = await run_in_threadpool(read_upload_meta, path)
+
+    if not 0 <= index < chunk_count(meta):
+        raise HTTPException(status_code=400, detail="Chunk index out of range")
+
+    limit = meta["chunk_size"]
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > limit:
+        raise HTTPException(status_code=413, detail="Chunk larger than chunk_size")
+
+    # Stream to a temp file then rename, so an oversized, retried or interrupted PUT
+    # never buffers the body in memory or leaves a partial chunk behind
+    chunk_path = os.path.join(path, f"{index:06d}.part")
+    tmp_path = f"{chunk_path}.{uuid.uuid4().hex}.tmp"
+    received = 0
+    try:
+        f = await run_in_threadpool(open, tmp_path, "wb")
+        try:
+            async for part in request.stream():
+                received += len(part)
+                if received > limit:
+                    raise HTTPException(status_code=413, detail="Chunk larger than chunk_size")
+                await run_in_threadpool(f.write, part)
+        finally:
+            await run_in_threadpool(f.close)
+        await run_in_threadpool(os.replace, tmp_path, chunk_path)
+    except BaseException:
+        # Plain call: a single unlink, and it must still run if the request was cancelled
+        remove_if_exists(tmp_path)
+        raise
+
+    return {"upload_id": upload_id, "index": index, "size": received}
+
+
+@app.post("/files/upload/{upload_id}/complete", response_model=FileUploadResponse, tags=["Files"])
+def complete_chunked_upload(
+    upload_id: str,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db)
+):
+    path = chunked_upload_dir(upload_id)
+    meta = read_upload_meta(path)
+
+    chunk_paths = [os.path.join(path, f"{i:06d}.part") for i in range(chunk_count(meta))]
+    missing = [i for i, p in enumerate(chunk_paths) if not os.path.exists(p)]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Missing chunks: {missing}")
+
+    if sum(os.path.getsize(p) for p in chunk_paths) != meta["size"]:
+        raise HTTPException(status_code=400, detail="Uploaded size does not match declared size")
+
+    # Read every chunk straight into one preallocated buffer, so only one copy of the file exists
+    content = bytearray(meta["size"])
+    view = memoryview(content)
+    offset = 0
+    for chunk_path in chunk_paths:
+        with open(chunk_path, "rb") as f:
+            while True:
+                n = f.readinto(view[offset:])
+                if not n:
+                    break
+                offset += n
+    view.release()
+
+    shutil.rmtree(path, ignore_errors=True)
+
+    file_id = str(uuid.uuid4())
+    record = FileRecord(
+        id=file_id,
+        filename=meta["filename"],
+        content_type="application/pdf",
+        content_hash=hashlib.sha256(content).hexdigest(),
+    )
+    db.add(record)
+    db.commit()
+
+    background_tasks.add_task(background_extraction_task, file_id, content, meta["filename"], db)
+
+    return FileUploadResponse(
+        file_id=file_id,
+        filename=meta["filename"],
+        message="Upload successful. Processing in background."
+    )
+
+
+@app.get("/files/by-hash/{content_hash}", tags=["Files"])
+def get_file_by_hash(content_hash: str, db: Session = Depends(get_db)):
+    record = (
+        db.query(FileRecord)
+        .filter(FileRecord.content_hash == content_hash.lower(), FileRecord.status == FileStatus.COMPLETED)
+        .order_by(FileRecord.created_at.desc())
+        .first()
+    )
+    if not record:
+        raise HTTPException(status_code=404, detail="File not found")
+    return {"file_id": record.id, "filename": record.filename, "status": record.status}
+
+
 @app.get("/files/{file_id}", response_model=FileRetrieveResponse, tags=["Files"])
 def get_file(file_id: str, db: Session = Depends(get_db)):
     record = db.query(FileRecord).filter(FileRecord.id == file_id).first()
@@ -501,6 +834,26 @@ async def merge_pdfs(request: MergePdfRequest = Body(...), db: Session = Depends
     )
 
 
+@app.post("/files/status", tags=["Files"])
+def batch_file_status(request: FileStatusRequest = Body(...), db: Session = Depends(get_db)):
+    """Return {file_id: status} for every known id; unknown ids are omitted."""
+    return file_statuses(db, request.ids)
+
+
+@app.post("/files/status/wait", tags=["Files"])
+async def wait_batch_file_status(request: FileStatusWaitRequest = Body(...), db: Session = Depends(get_db)):
+    """Long-poll form of /files/status: returns as soon as any file changes state, or after timeout."""
+    return await wait_for_status_change(db, request.ids, request.timeout)
+
+
+@app.get("/files/{file_id}/wait", tags=["Files"])
+async def wait_file_status(file_id: str, timeout: float = 30, db: Session = Depends(get_db)):
+    statuses = await wait_for_status_change(db, [file_id], timeout)
+    if file_id not in statuses:
+        raise HTTPException(status_code=404, detail="File not found")
+    return {"file_id": file_id, "status": statuses[file_id]}
+
+
 @app.get("/files/", tags=["Files"])
 def list_files(limit: int = 20, db: Session = Depends(get_db)):
     files = db.query(FileRecord).order_by(FileRecord.created_at.desc()).limit(limit).all()
@@ -515,8 +868,12 @@ def list_files(limit: int = 20, db: Session = Depends(get_db)):
     ]
 
 
-@app.post("/chat-with-document", tags=["Files"])
-async def chat_with_documents(request: MultiChatRequest, db: Session = Depends(get_db)):
+# Shared by /chat-with-document and its streaming variant so both answer paths stay identical
+CHAT_COMPLETION_KWARGS = {"model": "gemma3", "temperature": 0.5, "max_tokens": 1024}
+
+
+def build_chat_context(request: MultiChatRequest, db: Session) -> Tuple[str, List[Dict], List[Dict]]:
+    """Validate the request, run hybrid retrieval and assemble the LLM messages."""
     if not request.file_ids:
         raise HTTPException(status_code=400, detail="file_ids required")
 
@@ -624,13 +981,37 @@ Answer clearly and professionally."""
         *[{"role": m.role, "content": m.content} for m in recent_messages]
     ]
 
+    return question, sources, full_messages
+
+
+def format_sources(sources: List[Dict]) -> List[Dict]:
+    sources.sort(key=lambda x: x["relevance_score"], reverse=True)
+    return [
+        {
+            "filename": s["filename"],
+            "page": s["page"],
+            "excerpt": s["excerpt"][:500],
+            "relevance_score": s["relevance_score"]
+        }
+        for s in sources[:5]
+    ]
+
+
+def with_contradiction_warning(answer: str, contradiction_warning: Optional[str]) -> str:
+    if contradiction_warning:
+        return f"⚠️ **Potential Contradiction Detected**\n\n{contradiction_warning}\n\n**Answer:**\n{answer}"
+    return answer
+
+
+@app.post("/chat-with-document", tags=["Files"])
+async def chat_with_documents(request: MultiChatRequest, db: Session = Depends(get_db)):
+    question, sources, full_messages = build_chat_context(request, db)
+
     try:
         client = get_openai_client()
         response = await client.chat.completions.create(
-            model="gemma3",
             messages=full_messages,
-            temperature=0.5,
-            max_tokens=1024,
+            **CHAT_COMPLETION_KWARGS,
         )
 
         answer = response.choices[0].message.content.strip()
@@ -638,29 +1019,61 @@ Answer clearly and professionally."""
         # === Detect contradictions ===
         contradiction_warning = await detect_contradictions(question, sources[:10])
 
-        sources.sort(key=lambda x: x["relevance_score"], reverse=True)
-
-        final_answer = answer
-        if contradiction_warning:
-            final_answer = f"⚠️ **Potential Contradiction Detected**\n\n{contradiction_warning}\n\n**Answer:**\n{answer}"
-
         return {
-            "answer": final_answer,
-            "sources": [
-                {
-                    "filename": s["filename"],
-                    "page": s["page"],
-                    "excerpt": s["excerpt"][:500],
-                    "relevance_score": s["relevance_score"]
-                }
-                for s in sources[:5]
-            ]
+            "answer": with_contradiction_warning(answer, contradiction_warning),
+            "sources": format_sources(sources)
         }
     except Exception as e:
         logger.error(f"LLM call failed: {e}")
         raise HTTPException(status_code=500, detail="Failed to generate response")
 
 
+def sse_event(data: Dict) -> str:
+    return f"data: {orjson.dumps(data).decode()}\n\n"
+
+
+@app.post("/chat-with-document/stream", tags=["Files"])
+async def chat_with_documents_stream(request: MultiChatRequest, db: Session = Depends(get_db)):
+    """Stream answer tokens as SSE `delta` events, then a final `done` event with the full answer and sources."""
+    question, sources, full_messages = build_chat_context(request, db)
+
+    async def event_stream():
+        try:
+            client = get_openai_client()
+            stream = await client.chat.completions.create(
+                messages=full_messages,
+                stream=True,
+                **CHAT_COMPLETION_KWARGS,
+            )
+
+            answer_parts = []
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    answer_parts.append(delta)
+                    yield sse_event({"delta": delta})
+
+            answer = "".join(answer_parts).strip()
+            contradiction_warning = await detect_contradictions(question, sources[:10])
+
+            yield sse_event({
+                "done": True,
+                "answer": with_contradiction_warning(answer, contradiction_warning),
+                "sources": format_sources(sources)
+            })
+        except Exception as e:
+            logger.error(f"LLM streaming call failed: {e}")
+            yield sse_event({"error": "Failed to generate response"})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.delete("/files/{file_id}", tags=["Files"])
 def delete_file(file_id: str, db: Session = Depends(get_db)):
     record = db.query(FileRecord).filter(FileRecord.id == file_id).first()
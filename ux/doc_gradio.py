@@ -1,144 +1,424 @@
 """
 Dwani.ai Gradio UI - Multiple File Upload + Chat Display PERFECTED
+
+Run:  python doc_gradio.py --workers 4
+  or  uvicorn doc_gradio:app --host 0.0.0.0 --port 7860 --workers 4 --loop uvloop --http httptools --no-access-log
+
+With more than one worker, put a reverse proxy (nginx/Caddy, which also terminates
+TLS + HTTP/2) in front with sticky sessions, since Gradio's queue lives per process.
 """
 
+import argparse
 import gradio as gr
+import uvicorn
+from fastapi import FastAPI
+import orjson
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from requests_toolbelt.multipart.encoder import MultipartEncoder
+from urllib3.util.retry import Retry
 from typing import List, Dict
 from datetime import datetime
+import atexit
+import functools
+import gzip
+import hashlib
+import logging
+import mmap
+import os
+import shutil
+import tempfile
+import threading
 import time
 
 API_BASE = "http://localhost:8000"
+MAX_UPLOAD_WORKERS = 8
+# Files at or above this size go through the chunked upload endpoints
+CHUNKED_UPLOAD_THRESHOLD = 20 * 1024 * 1024
+CHUNK_UPLOAD_WORKERS = 4
+# Repeated refreshes within this many seconds reuse the last file list
+LIST_CACHE_TTL = 2.0
+# Chat bodies at or above this size are gzip-compressed on the wire
+COMPRESS_MIN_BYTES = 4096
+# Gradio events allowed to run at once; each may fan out to MAX_UPLOAD_WORKERS requests
+HANDLER_CONCURRENCY = 4
+
+# (connect, read) seconds; chat waits longer for the LLM and contradiction check
+REQUEST_TIMEOUT = (3, 30)
+CHAT_TIMEOUT = (3, 120)
+# Seconds the server may hold a status long-poll open
+LONG_POLL_TIMEOUT = 30
+
+logger = logging.getLogger("dwani_ux")
 
 class DwaniClient:
-    def __init__(self, base_url=API_BASE):
+    def __init__(self, base_url=API_BASE, pool_size=20):
         self.base_url = base_url.rstrip('/')
+        # One keep-alive session for every call, so polling doesn't redo the handshake
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=pool_size,
+            # Retry only on gateway errors, and only for requests that can be replayed:
+            # a streamed multipart upload can't be resent, and POSTs may not be idempotent
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.3,
+                status_forcelist=[502, 503, 504],
+                allowed_methods=["GET", "HEAD", "PUT"]
+            )
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._list_lock = threading.Lock()
+        self._list_cache = None  # (fetched_at, files)
+    
+    def close(self):
+        self.session.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
     
     def upload_file(self, file_path: str) -> dict:
         with open(file_path, 'rb') as f:
-            files = {'file': f}
-            resp = requests.post(f"{self.base_url}/files/upload", files=files)
+            # Stream the multipart body from disk instead of building it in memory
+            body = MultipartEncoder(
+                fields={'file': (os.path.basename(file_path), f, 'application/pdf')}
+            )
+            resp = self.session.post(
+                f"{self.base_url}/files/upload",
+                data=body,
+                headers={'Content-Type': body.content_type},
+                timeout=REQUEST_TIMEOUT
+            )
             resp.raise_for_status()
-            return resp.json()
+            self._list_cache = None
+            return orjson.loads(resp.content)
+    
+    def upload_file_chunked(self, file_path: str, chunk_size: int = None, max_attempts: int = 3) -> dict:
+        """Upload a large file as parallel chunk PUTs, retrying only the chunks that fail"""
+        size = os.path.getsize(file_path)
+        chunk_size = chunk_size or pick_chunk_size(size)
+        
+        resp = self.session.post(
+            f"{self.base_url}/files/upload/init",
+            json={"filename": os.path.basename(file_path), "size": size, "chunk_size": chunk_size},
+            timeout=REQUEST_TIMEOUT
+        )
+        resp.raise_for_status()
+        upload_id = orjson.loads(resp.content)['upload_id']
+        
+        with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            def put_chunk(index, offset):
+                # Slice inside the worker so only CHUNK_UPLOAD_WORKERS chunks are in memory at once
+                data = mm[offset:offset + chunk_size]
+                r = self.session.put(f"{self.base_url}/files/upload/{upload_id}/{index}", data=data, timeout=REQUEST_TIMEOUT)
+                r.raise_for_status()
+            
+            pending = list(enumerate(range(0, size, chunk_size)))
+            with ThreadPoolExecutor(max_workers=CHUNK_UPLOAD_WORKERS) as executor:
+                for _ in range(max_attempts):
+                    futures = {
+                        executor.submit(put_chunk, index, offset): (index, offset)
+                        for index, offset in pending
+                    }
+                    pending = []
+                    for future in as_completed(futures):
+                        try:
+                            future.result()
+                        except requests.RequestException as e:
+                            logger.warning(f"Chunk {futures[future][0]} of {file_path} failed: {e}")
+                            pending.append(futures[future])
+                    if not pending:
+                        break
+                else:
+                    raise RuntimeError(f"{len(pending)} chunk(s) failed after {max_attempts} attempts")
+        
+        resp = self.session.post(f"{self.base_url}/files/upload/{upload_id}/complete", timeout=REQUEST_TIMEOUT)
+        resp.raise_for_status()
+        self._list_cache = None
+        return orjson.loads(resp.content)
+    
+    def find_by_hash(self, content_hash: str):
+        """Completed file with this SHA-256, or None if the server hasn't seen it"""
+        resp = self.session.get(f"{self.base_url}/files/by-hash/{content_hash}", timeout=REQUEST_TIMEOUT)
+        if resp.status_code == 404:
+            return None
+        resp.raise_for_status()
+        return orjson.loads(resp.content)
     
     def get_file_status(self, file_id: str) -> dict:
-        resp = requests.get(f"{self.base_url}/files/{file_id}")
+        resp = self.session.get(f"{self.base_url}/files/{file_id}", timeout=REQUEST_TIMEOUT)
+        resp.raise_for_status()
+        return orjson.loads(resp.content)
+    
+    def download_clean_pdf(self, file_id: str) -> str:
+        """Stream the regenerated PDF to a temp file in 64 KB chunks; the caller removes it"""
+        with self.session.get(f"{self.base_url}/files/{file_id}/pdf", stream=True, timeout=REQUEST_TIMEOUT) as resp:
+            resp.raise_for_status()
+            resp.raw.decode_content = True
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
+                try:
+                    shutil.copyfileobj(resp.raw, tmp, length=65536)
+                except BaseException:
+                    tmp.close()
+                    remove_files([tmp.name])
+                    raise
+        return tmp.name
+    
+    def batch_status(self, file_ids: List[str]) -> Dict[str, str]:
+        """Statuses for many files in one request; unknown ids are left out"""
+        resp = self.session.post(f"{self.base_url}/files/status", json={"ids": file_ids}, timeout=REQUEST_TIMEOUT)
+        resp.raise_for_status()
+        return orjson.loads(resp.content)
+    
+    def wait_status(self, file_ids: List[str], timeout: float = LONG_POLL_TIMEOUT) -> Dict[str, str]:
+        """Like batch_status, but the server holds the request until any file changes state"""
+        resp = self.session.post(
+            f"{self.base_url}/files/status/wait",
+            json={"ids": file_ids, "timeout": timeout},
+            timeout=(REQUEST_TIMEOUT[0], timeout + 5)
+        )
         resp.raise_for_status()
-        return resp.json()
+        return orjson.loads(resp.content)
     
     def list_files(self) -> List[dict]:
-        resp = requests.get(f"{self.base_url}/files/")
+        resp = self.session.get(f"{self.base_url}/files/", timeout=REQUEST_TIMEOUT)
         resp.raise_for_status()
-        return resp.json()
+        return orjson.loads(resp.content)
+    
+    def list_files_cached(self, max_age: float = LIST_CACHE_TTL) -> List[dict]:
+        """list_files, reusing a recent result; concurrent callers share one in-flight GET"""
+        with self._list_lock:
+            cached = self._list_cache
+            if cached is None or time.monotonic() - cached[0] > max_age:
+                cached = self._list_cache = (time.monotonic(), self.list_files())
+            return cached[1]
+    
+    def _json_body(self, payload: dict):
+        """Encode a JSON body, gzipping it once the chat history makes it large"""
+        data = orjson.dumps(payload)
+        headers = {"Content-Type": "application/json"}
+        if len(data) >= COMPRESS_MIN_BYTES:
+            data = gzip.compress(data, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+        return data, headers
     
     def chat(self, file_ids: List[str], messages: List[Dict]) -> dict:
-        payload = {"file_ids": file_ids, "messages": messages}
-        resp = requests.post(f"{self.base_url}/chat-with-document", json=payload)
+        data, headers = self._json_body({"file_ids": file_ids, "messages": messages})
+        resp = self.session.post(
+            f"{self.base_url}/chat-with-document", data=data, headers=headers, timeout=CHAT_TIMEOUT
+        )
         resp.raise_for_status()
-        return resp.json()
+        return orjson.loads(resp.content)
+    
+    def chat_stream(self, file_ids: List[str], messages: List[Dict]):
+        """Yield SSE events ({'delta'}, then {'done', 'answer', 'sources'}) as the answer is generated"""
+        data, headers = self._json_body({"file_ids": file_ids, "messages": messages})
+        # Compressed event streams get buffered by the encoder, so ask for the raw stream
+        headers["Accept-Encoding"] = "identity"
+        with self.session.post(
+            f"{self.base_url}/chat-with-document/stream", data=data, headers=headers, stream=True, timeout=CHAT_TIMEOUT
+        ) as resp:
+            resp.raise_for_status()
+            for line in resp.iter_lines(decode_unicode=True):
+                if line and line.startswith("data:"):
+                    yield orjson.loads(line[5:])
 
-client = DwaniClient()
-uploaded_files = {}
-chat_history: List[Dict] = []
-selected_files = []
+def pick_chunk_size(size: int) -> int:
+    """Smaller chunks for small files keep parallelism, larger ones cap request count"""
+    if size < 20 * 1024 * 1024:
+        return 1024 * 1024
+    if size < 200 * 1024 * 1024:
+        return 5 * 1024 * 1024
+    return 10 * 1024 * 1024
 
-def poll_file_status(file_id: str, max_wait=60):
-    """Wait for file processing"""
-    for _ in range(max_wait):
+STATUS_EMOJI = {
+    'completed': '✅', 
+    'processing': '🔄', 
+    'pending': '⏳', 
+    'failed': '❌'
+}
+
+# Shared by all sessions; per-user data lives in gr.State (see UI LAYOUT)
+client = DwaniClient(pool_size=MAX_UPLOAD_WORKERS * HANDLER_CONCURRENCY)
+atexit.register(client.close)
+
+def poll_files_status(file_ids: List[str], max_wait=120, max_failures=3) -> Dict[str, str]:
+    """Wait for several files with one batched long-poll per status change"""
+    pending = set(file_ids)
+    final = {}
+    delay = 0.1
+    failures = 0
+    deadline = time.monotonic() + max_wait
+    while pending and time.monotonic() < deadline:
         try:
-            status = client.get_file_status(file_id)
-            if status['status'] == 'completed': return status, True
-            if status['status'] == 'failed': return status, False
-            time.sleep(2)
-        except: time.sleep(2)
-    return {'status': 'timeout'}, False
+            remaining = deadline - time.monotonic()
+            statuses = client.wait_status(list(pending), timeout=min(LONG_POLL_TIMEOUT, remaining))
+            failures = 0
+            delay = 0.1
+            for file_id in list(pending):
+                status = statuses.get(file_id, 'failed')
+                if status in ('completed', 'failed'):
+                    final[file_id] = status
+                    pending.discard(file_id)
+        except (requests.RequestException, orjson.JSONDecodeError) as e:
+            failures += 1
+            logger.warning(f"Status check failed ({failures}/{max_failures}): {e}")
+            if failures >= max_failures:
+                final.update((file_id, 'error') for file_id in pending)
+                return final
+            # The server paces successful calls; only back off after errors
+            time.sleep(delay)
+            delay = min(delay * 1.7, 2.0)
+    final.update((file_id, 'timeout') for file_id in pending)
+    return final
 
-def upload_multiple(files):
+def file_digest(file_path: str) -> str:
+    """SHA-256 of a file, read in 1 MB chunks"""
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _upload_one(file):
+    """Upload one file, returning (file_id, filename, error)"""
+    try:
+        # Skip the upload entirely if the server already processed identical bytes
+        existing = client.find_by_hash(file_digest(file.name))
+        if existing:
+            return existing['file_id'], existing['filename'], None
+        
+        if os.path.getsize(file.name) >= CHUNKED_UPLOAD_THRESHOLD:
+            result = client.upload_file_chunked(file.name)
+        else:
+            result = client.upload_file(file.name)
+        return result['file_id'], result['filename'], None
+    except Exception as e:
+        return None, file.name, str(e)
+
+def upload_multiple(files, uploaded_files, completed_choices):
     """Handle multiple PDF uploads"""
     if not files:
-        return "No files selected", gr.update(choices=[])
+        return "No files selected", gr.update(), create_file_list(uploaded_files), uploaded_files, completed_choices
     
-    global uploaded_files
+    uploaded_files = dict(uploaded_files)
+    completed_choices = dict(completed_choices)
     status_msgs = []
     
-    for file in files:
-        try:
-            # Upload each file
-            result = client.upload_file(file.name)
-            file_id = result['file_id']
-            filename = result['filename']
-            
-            uploaded_files[file_id] = {
-                'filename': filename, 
-                'status': 'pending',
-                'file_id': file_id
-            }
-            
-            # Poll for completion
-            status, success = poll_file_status(file_id)
-            
-            if success:
-                uploaded_files[file_id]['status'] = 'completed'
-                status_msgs.append(f"✅ {filename} - READY")
+    # Uploads are I/O bound, so run them side by side on the shared session pool
+    uploads = []
+    with ThreadPoolExecutor(max_workers=min(MAX_UPLOAD_WORKERS, len(files))) as executor:
+        futures = [executor.submit(_upload_one, file) for file in files]
+        for future in as_completed(futures):
+            file_id, filename, error = future.result()
+            if error:
+                status_msgs.append(f"❌ {filename} - ERROR: {error}")
             else:
-                uploaded_files[file_id]['status'] = 'failed'
-                status_msgs.append(f"❌ {filename} - FAILED")
-                
-        except Exception as e:
-            status_msgs.append(f"❌ {file.name} - ERROR: {str(e)}")
+                uploads.append((file_id, filename))
     
-    # Update choices for only completed files
-    choices = [(info['filename'], info['file_id']) for info in uploaded_files.values() 
-               if info['status'] == 'completed']
+    # Then wait for all of them with a single batched poll loop
+    statuses = poll_files_status([file_id for file_id, _ in uploads])
+    for file_id, filename in uploads:
+        success = statuses[file_id] == 'completed'
+        status_msgs.append(f"✅ {filename} - READY" if success else f"❌ {filename} - FAILED")
+        uploaded_files[file_id] = {
+            'filename': filename, 
+            'status': 'completed' if success else 'failed',
+            'file_id': file_id
+        }
+        # Only files from this batch change, so update just their entries
+        if success:
+            completed_choices.setdefault(file_id, (filename, file_id))
+        else:
+            completed_choices.pop(file_id, None)
     
-    return "\n".join(status_msgs), gr.update(choices=choices), create_file_list()
+    return (
+        "\n".join(status_msgs),
+        gr.update(choices=list(completed_choices.values())),
+        create_file_list(uploaded_files),
+        uploaded_files,
+        completed_choices
+    )
 
-def refresh_files():
+def refresh_files(uploaded_files, completed_choices):
     """Refresh from server"""
     try:
-        files = client.list_files()
-        global uploaded_files
-        uploaded_files.clear()
-        
-        for f in files:
-            uploaded_files[f['file_id']] = f
-        
-        choices = [(f['filename'], f['file_id']) for f in files if f['status'] == 'completed']
-        return create_file_list(), gr.update(choices=choices)
-    except:
-        return "Refresh failed", gr.update()
+        files = client.list_files_cached()
+        uploaded_files = {f['file_id']: dict(f) for f in files}
+        completed_choices = {
+            f['file_id']: (f['filename'], f['file_id']) for f in files if f['status'] == 'completed'
+        }
+        return (
+            create_file_list(uploaded_files),
+            gr.update(choices=list(completed_choices.values())),
+            uploaded_files,
+            completed_choices
+        )
+    except Exception as e:
+        logger.warning(f"Refresh failed: {e}")
+        return "Refresh failed", gr.update(), uploaded_files, completed_choices
 
-def create_file_list():
+def create_file_list(uploaded_files):
     """Display all files with status"""
-    if not uploaded_files:
+    return _render_file_list(tuple((info['filename'], info['status']) for info in uploaded_files.values()))
+
+@functools.lru_cache(maxsize=32)
+def _render_file_list(entries):
+    """Render (filename, status) pairs; identical file lists reuse the cached markdown"""
+    if not entries:
         return "No files uploaded"
     
-    lines = ["**📁 Your Files:**"]
-    for info in uploaded_files.values():
-        emoji = {
-            'completed': '✅', 
-            'processing': '🔄', 
-            'pending': '⏳', 
-            'failed': '❌'
-        }.get(info['status'], '❓')
-        lines.append(f"{emoji} {info['filename']} ({info['status']})")
-    return "\n".join(lines)
+    emoji = STATUS_EMOJI.get
+    return "**📁 Your Files:**\n" + "\n".join(
+        f"{emoji(status, '❓')} {filename} ({status})" for filename, status in entries
+    )
 
 def update_selected_files(files):
     """Update selected files"""
-    global selected_files
     selected_files = files or []
-    return len(selected_files)
+    return len(selected_files), selected_files
 
-def send_message(message, history):
-    """Send chat message - FIXED DISPLAY"""
-    global chat_history, selected_files
-    
+def remove_files(paths):
+    """Best-effort delete of local temp files"""
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def download_selected(selected_files):
+    """Download clean PDFs for the selected files"""
+    if not selected_files:
+        return gr.update(value=None), "⚠️ Please select files first!", []
+    paths = []
+    try:
+        for file_id in selected_files:
+            paths.append(client.download_clean_pdf(file_id))
+        return paths, "", paths
+    except Exception as e:
+        remove_files(paths)
+        return gr.update(value=None), f"❌ Download failed: {str(e)}", []
+
+def cleanup_downloads(paths):
+    """Gradio has copied the files into its cache by now, so drop our temp copies"""
+    remove_files(paths)
+    return []
+
+def send_message(message, history, selected_files, chat_history):
+    """Send chat message, streaming the answer into the chat as it arrives"""
     if not message.strip():
-        return history, ""
+        yield history, "", chat_history
+        return
     
     if not selected_files:
-        return history, "⚠️ Please select files first!"
+        yield history, "⚠️ Please select files first!", chat_history
+        return
     
     # Create new history entry for user
     user_message = {"role": "user", "content": message}
@@ -146,52 +426,64 @@ def send_message(message, history):
     
     # Update UI immediately
     new_history = history + [user_message, assistant_message]
+    yield new_history, "", chat_history
     
     try:
         # Prepare full conversation for API
         api_messages = chat_history + [user_message]
         
-        # Call backend
-        result = client.chat(selected_files, api_messages)
-        
-        # Update chat history with real response
-        chat_history.append(user_message)
-        chat_history.append({"role": "assistant", "content": result['answer']})
-        
-        # Format beautiful response with sources
-        full_response = format_chat_response(result)
+        partial = ""
+        for event in client.chat_stream(selected_files, api_messages):
+            if 'error' in event:
+                raise RuntimeError(event['error'])
+            if event.get('done'):
+                # Update chat history with real response
+                chat_history = chat_history + [user_message, {"role": "assistant", "content": event['answer']}]
+                
+                # Replace the streamed text with the formatted answer and sources
+                yield history + [user_message, {"role": "assistant", "content": format_chat_response(event)}], "", chat_history
+                return
+            partial += event['delta']
+            yield history + [user_message, {"role": "assistant", "content": partial}], "", chat_history
         
-        # Replace "Thinking..." with real answer
-        final_history = history + [user_message, {"role": "assistant", "content": full_response}]
-        return final_history, ""
+        raise RuntimeError("Response stream ended early")
         
     except Exception as e:
         error_response = {"role": "assistant", "content": f"❌ Error: {str(e)}"}
-        return new_history[:-1] + [error_response], f"Error: {str(e)}"
+        yield new_history[:-1] + [error_response], f"Error: {str(e)}", chat_history
 
 def format_chat_response(result):
     """Format response with sources"""
     answer = result['answer']
+    sources = result.get('sources')
+    if not sources:
+        return answer
     
-    if result.get('sources'):
-        sources = "\n\n**📚 Sources:**\n"
-        for i, src in enumerate(result['sources'][:5], 1):
-            sources += f"{i}. **{src['filename']}** (Page {src['page']})\n"
-            sources += f"   > {src['excerpt'][:120]}...\n\n"
-        return answer + sources
-    return answer
+    # The backend already labels pages ("Page 3" / "Pages 3–4")
+    parts = [
+        f"{i}. **{src['filename']}** ({src['page']})\n   > {src['excerpt'][:120]}...\n"
+        for i, src in enumerate(sources[:5], 1)
+    ]
+    return f"{answer}\n\n**📚 Sources:**\n" + "\n".join(parts) + "\n"
 
 def clear_chat():
     """Clear conversation"""
-    global chat_history
-    chat_history = []
-    return []
+    return [], []
 
 # === UI LAYOUT ===
 with gr.Blocks(title="Dwani.ai", theme=gr.themes.Soft()) as demo:
     gr.Markdown("# 📚 Dwani.ai - Document Chat")
     gr.Markdown("**Upload multiple PDFs → Chat with page-accurate citations**")
     
+    # Per-session state, so concurrent users never see each other's files or chats
+    uploaded_state = gr.State({})
+    # {file_id: (filename, file_id)} for completed files, kept in checkbox order
+    choices_state = gr.State({})
+    history_state = gr.State([])
+    selected_state = gr.State([])
+    # Temp paths of the last download, removed once Gradio has cached them
+    download_paths_state = gr.State([])
+    
     with gr.Row():
         with gr.Column(scale=1):
             gr.Markdown("## 📤 Upload Multiple PDFs")
@@ -215,6 +507,9 @@ with gr.Blocks(title="Dwani.ai", theme=gr.themes.Soft()) as demo:
                 info="Only completed files appear here"
             )
             file_count = gr.Number(label="Files selected", value=0, interactive=False)
+            download_btn = gr.Button("⬇️ Download Clean PDFs")
+            download_output = gr.File(label="Clean PDFs", file_count="multiple")
+            download_status = gr.Markdown("")
     
     with gr.Row():
         gr.Markdown("## 💬 Chat with Documents")
@@ -238,43 +533,74 @@ with gr.Blocks(title="Dwani.ai", theme=gr.themes.Soft()) as demo:
     # Event connections
     upload_btn.click(
         upload_multiple,
-        inputs=file_input,
-        outputs=[status_output, file_checkboxes, files_display]
+        inputs=[file_input, uploaded_state, choices_state],
+        outputs=[status_output, file_checkboxes, files_display, uploaded_state, choices_state]
     )
     
     refresh_btn.click(
         refresh_files,
-        outputs=[files_display, file_checkboxes]
+        inputs=[uploaded_state, choices_state],
+        outputs=[files_display, file_checkboxes, uploaded_state, choices_state]
     )
     
     file_checkboxes.change(
         update_selected_files,
         inputs=file_checkboxes,
-        outputs=file_count
+        outputs=[file_count, selected_state]
+    )
+    
+    download_btn.click(
+        download_selected,
+        inputs=selected_state,
+        outputs=[download_output, download_status, download_paths_state]
+    ).then(
+        cleanup_downloads,
+        inputs=download_paths_state,
+        outputs=download_paths_state
     )
     
     send_btn.click(
         send_message,
-        inputs=[msg_input, chatbot],
-        outputs=[chatbot, msg_input]
+        inputs=[msg_input, chatbot, selected_state, history_state],
+        outputs=[chatbot, msg_input, history_state]
     )
     
     msg_input.submit(
         send_message,
-        inputs=[msg_input, chatbot],
-        outputs=[chatbot, msg_input]
+        inputs=[msg_input, chatbot, selected_state, history_state],
+        outputs=[chatbot, msg_input, history_state]
     )
     
     clear_btn.click(
         clear_chat,
-        outputs=chatbot
+        outputs=[chatbot, history_state]
     )
 
+demo.queue(default_concurrency_limit=HANDLER_CONCURRENCY)
+app = gr.mount_gradio_app(FastAPI(title="Dwani.ai UI"), demo, path="/")
+
 if __name__ == "__main__":
-    demo.launch(
-        server_name="0.0.0.0",
-        server_port=7860,
-        share=False,
-        show_error=True,
-        debug=True
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=7860)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    # Multiple workers need an import string; for one worker, serve the app already built here
+    # rather than re-importing this module under a second name
+    if args.workers > 1:
+        target = "doc_gradio:app"
+        extra = {"app_dir": os.path.dirname(os.path.abspath(__file__)), "workers": args.workers}
+    else:
+        target = app
+        extra = {}
+
+    uvicorn.run(
+        target,
+        host=args.host,
+        port=args.port,
+        loop="auto",  # uvloop / httptools when installed (uvicorn[standard])
+        http="auto",
+        access_log=False,
+        **extra
     )